@@ -1,6 +1,71 @@
-try:
+from array import array
+from importlib.util import find_spec
+
+
+def _make_client(api_key: str):
+    import httpx
     from openai import OpenAI
+    # one client for the whole session: keep‑alive pool, no TLS handshake per call
+    return OpenAI(
+        api_key=api_key,
+        max_retries=1,  # the REPL waits on every call — give up early, callers fall back
+        http_client=httpx.Client(
+            http2=find_spec("h2") is not None,  # httpx needs h2 for HTTP/2
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=20),
+            timeout=httpx.Timeout(15.0, connect=3.0),
+        ),
+    )
+
+
+class _LazyClient:
+    """Stands in for the OpenAI client; openai and httpx are imported on first use."""
+    __slots__ = ("_key", "_real")
+
+    def __init__(self, api_key: str):
+        self._key, self._real = api_key, None
+
+    def __getattr__(self, name):
+        if self._real is None:
+            self._real = _make_client(self._key)
+        return getattr(self._real, name)
+
+
+try:
     with open("key.txt", "r", encoding="utf-8") as f:
-        client = OpenAI(api_key=f.read().strip())
-except (ImportError, FileNotFoundError):
-    client = None
+        _key = f.read().strip()
+except FileNotFoundError:
+    _key = ""
+client = _LazyClient(_key) if _key and find_spec("openai") and find_spec("httpx") else None
+
+
+def __getattr__(name):
+    # ai.APIError — openai's base exception, resolved here so importing ai stays cheap.
+    # An `except ai.APIError:` clause is only evaluated once something was raised.
+    if name == "APIError":
+        from openai import OpenAIError
+        return OpenAIError
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+EMBED_MODEL = "text-embedding-3-small"
+EMBED_BATCH = 512             # inputs per request — the endpoint takes at most 2048
+EMBED_BATCH_CHARS = 200_000   # and caps the tokens of a whole request
+
+
+def embed(texts: list[str]) -> list[array]:
+    """Unit‑length float32 embeddings for `texts`, in order, in batches the endpoint accepts."""
+    vectors, batch, size = [], [], 0
+    for text in texts:
+        if batch and (len(batch) == EMBED_BATCH or size + len(text) > EMBED_BATCH_CHARS):
+            vectors += _embed_batch(batch)
+            batch, size = [], 0
+        batch.append(text)
+        size += len(text)
+    if batch:
+        vectors += _embed_batch(batch)
+    return vectors
+
+
+def _embed_batch(texts: list[str]) -> list[array]:
+    resp = client.embeddings.create(model=EMBED_MODEL, input=texts)
+    return [array("f", d.embedding) for d in sorted(resp.data, key=lambda d: d.index)]
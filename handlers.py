@@ -1,255 +1,318 @@
-try:
-    from rich.console import Console
-except ImportError:  # pragma: no cover
-    class Console:
-        def print(self, *args, **kwargs):
-            print(*args)
-
-        def input(self, prompt: str = "") -> str:
-            return input(prompt)
-
-import re
+from array import array
+from collections import OrderedDict
+from itertools import islice
 
 from typing import Optional
 from models import (
     GeneralNote, Field, Record, AddressBook,
-    group_notes_by_tag, make_key, make_key_from_input, get_record_key
+    make_key, make_key_from_input, get_record_key
 )
 from logic import *
 from logic import input_error, help_msg, simple_match
-from ai import client as _client
+import ai
+from ai import client as _client, embed
+from storage import attach_embeddings
 
-console = Console()
 
 # ────────────────────────────────────────────────────────────────────────────
-# GPT semantic prompt
-# ────────────────────────────────────────────────────────────────────────────
-SEM_PROMPT = """You are a semantic search assistant.
-Below is a numbered list of notes. Each note has the format
-<index>: <text>  [tags: <tag1>, <tag2>, ...]
+# contacts
+def _contact_help(args, ab: AddressBook):
+    return help_msg("contacts")
+
+
+def _add(args, ab: AddressBook):
+    if not args:
+        name = prompt_validated("Enter name: ", allow_blank=False)
+        surname = prompt_validated("Enter surname: ")
+        phone = prompt_validated("Enter phone (10 digits): ", Phone)
+        email = prompt_validated("Enter email: ", Email)
+        address = prompt_validated("Enter address: ")
+    else:
+        name, *rest = args
+        surname = rest[0] if rest else ""
+        phone = rest[1] if len(rest) > 1 else ""
+        email = rest[2] if len(rest) > 2 else ""
+        address = " ".join(rest[3:]) if len(rest) > 3 else ""
+    key = make_key(name, surname)
+    rec = ab.get(key)
+    if rec:
+        if phone: rec.add_phone(phone)
+        if surname: rec.update_surname(surname)
+        if email: rec.update_email(email)
+        if address: rec.update_address(address)
+        return ok("Contact updated.")
+    rec = Record(name, surname, address, email)
+    if phone: rec.add_phone(phone)
+    ab.add_record(rec)
+    return ok("Contact added.")
+
+
+_CHANGE_FIELDS = ("phone", "email", "address")
+_UNKNOWN_FIELD = "[dim italic]Unknown command. Choose from: phone / email / address[/]\n"
+
+
+def _change(args, ab: AddressBook):
+    # change <name…> [<phone|email|address> [<value…>]] — the field keyword splits a
+    # multi-word name from the value; whatever is missing is asked for
+    name_prompt, field_prompt, value_prompt = ARG_PROMPTS["change"]
+    words = " ".join(args).split()
+    i = next((i for i, w in enumerate(words) if w.lower() in _CHANGE_FIELDS), len(words))
+    normalized_name = get_record_key(" ".join(words[:i]) or console.input(name_prompt).strip(), ab)
+    if not normalized_name:
+        if i > 1 and i == len(words) and get_record_key(" ".join(words[:-1]), ab):
+            return _UNKNOWN_FIELD  # 'change John Smith foo': the name is fine, the field is not
+        return "Ooops. Contact not found :-("
+
+    if i < len(words):
+        field, value = words[i].lower(), " ".join(words[i + 1:])
+    else:
+        field, value = console.input(field_prompt).strip().lower(), ""
+        if field not in _CHANGE_FIELDS:
+            return _UNKNOWN_FIELD
+    value = value or console.input(value_prompt).strip()
+    if not value:
+        raise ValueError("Usage: change <name> <phone|email|address> <value>")
+
+    record = ab[normalized_name]
+
+    if field == "phone":
+        record.set_phone(value)
+        return f"Phone updated for {normalized_name.capitalize()}"
+
+    elif field == "email":
+        record.update_email(value)
+        return f"Email updated for {normalized_name.capitalize()}"
+
+    else:
+        record.update_address(value)
+        return f"Address updated for {normalized_name.capitalize()}"
+
+
+def _remove_phone(args, ab: AddressBook):
+    name, phone = args
+    ab.find(name).remove_phone(phone)
+    return ok("Phone removed.")
+
+
+def _phone(args, ab: AddressBook):
+    name, = args
+    return ", ".join(ab.find(name).phones) or "No phones."
+
+
+def _delete(args, ab: AddressBook):
+    name, = args
+    ab.delete(name)
+    return ok("Contact deleted.")
+
+
+def _all(args, ab: AddressBook):
+    if args and not args[0].isdigit():
+        raise ValueError("Enter a positive integer for the page number")
+    page = int(args[0]) if args else 1
+    if page < 1:
+        raise ValueError("Page number must be positive.")
+    pages = max(1, -(-len(ab) // PAGE_SIZE))
+    if page > pages:
+        raise ValueError(f"Only {pages} page(s).")
+    start = (page - 1) * PAGE_SIZE
+    show_records(islice(ab.values(), start, start + PAGE_SIZE))
+    if pages > 1:
+        console.print(f"[dim italic]Page {page}/{pages} — 'all <N>' for another page.[/]")
+    return ""
+
+
+def _search(args, ab: AddressBook):
+    q, = args
+    show_records(ab.search(q))
+    return ""
+
+
+def _add_birthday(args, ab: AddressBook):
+    name, date = args
+    ab.find(name).add_birthday(date)
+    return ok("Birthday added.")
+
+
+def _show_birthday(args, ab: AddressBook):
+    key, = args
+    matches, label = ab.by_name(key), ""
+    if not matches:
+        close = ab.closest_name(key, LOCAL_MATCH_CUTOFF)
+        if close is None:
+            raise KeyError("Contact not found.")
+        matches, label = ab.by_name(close), f"[dim italic]No '{key}'; closest match:[/]\n"
+    return label + "\n".join([f"{r.name} {r.surname}: "
+                              f"{r.birthday.formatted if r.birthday else '—'}"
+                              for r in matches])
 
-User will send a search query in Russian, Ukrainian or English.
-Return ONLY the indices (space‑separated) of up to five notes
-that are truly relevant. If nothing fits, return an empty string.
-"""
 
+def _birthdays(args, ab: AddressBook):
+    days, = args
+    if not days.isdigit():
+        raise ValueError("Enter a positive integer for the number of days")
+    matches = ab.upcoming(int(days))
+    show_birthdays(ab, matches)
+    return ""
 
-@input_error
-def handle_contact(parts, ab: AddressBook):
-    cmd, *args = parts
-    if cmd in ("hello", "help"):
-        return help_msg("contacts")
-
-    # add/update
-    if cmd == "add":
-        if not args:
-            name = prompt_validated("Enter name: ", allow_blank=False)
-            surname = prompt_validated("Enter surname: ")
-            phone = prompt_validated("Enter phone (10 digits): ", Phone)
-            email = prompt_validated("Enter email: ", Email)
-            address = prompt_validated("Enter address: ")
-        else:
-            name, *rest = args
-            surname = rest[0] if rest else ""
-            phone = rest[1] if len(rest) > 1 else ""
-            email = rest[2] if len(rest) > 2 else ""
-            address = " ".join(rest[3:]) if len(rest) > 3 else ""
-        key = make_key(name, surname)
-        rec = ab.data.get(key)
-        if rec:
-            if phone: rec.add_phone(phone)
-            if surname: rec.surname = Surname(surname)
-            if email: rec.email = Email(email)
-            if address: rec.address = Address(address)
-            return ok("Contact updated.")
-        rec = Record(name, surname, Address(address) if address else "", Email(email) if email else "")
-        if phone: rec.add_phone(phone)
-        ab.data[key] = rec
-        return ok("Contact added.")
-
-    # phone change
-    if cmd == "change":
-        name_input = input("Which contact do you want to change? >>> ").strip()
-        normalized_name = get_record_key(name_input, ab)
-        if not normalized_name:
-            return "Ooops. Contact not found :-("
-
-        record = ab.data[normalized_name]
-
-        field = input("What do you want to change in this contact? (phone / email / address) >>> ").strip().lower()
-
-        if field == "phone":
-            new_phone = input("Enter new phone >>> ").strip()
-            record.phones = []
-            record.add_phone(new_phone)
-            return f"Phone updated for {normalized_name.capitalize()}"
-
-        elif field == "email":
-            new_email = input("Enter new email >>> ").strip()
-            record.update_email(new_email)
-            return f"Email updated for {normalized_name.capitalize()}"
-
-        elif field == "address":
-            new_address = input("Enter new address >>> ").strip()
-            record.update_address(new_address)
-            return f"Address updated for {normalized_name.capitalize()}"
-
-        else:
-            return "[dim italic]Unknown command. Choose from: phone / email / address[/]\n"
-
-    if cmd == "remove-phone":
-        name, phone = args
-        ab.find(name).remove_phone(phone)
-        return ok("Phone removed.")
-    if cmd == "phone":
-        name, = args
-        return ", ".join(p.value for p in ab.find(name).phones) or "No phones."
-    if cmd == "delete":
-        name, = args
-        ab.delete(name)
-        return ok("Contact deleted.")
-
-    # search/list
-    if cmd == "all":
-        show_records(list(ab.data.values()))
-        return ""
-    if cmd == "search":
-        q, = args
-        hits = [r for r in ab.data.values()
-                if q.lower() in r.name.value.lower()
-                or q.lower() in r.surname.value.lower()
-                or any(q in p.value for p in r.phones)
-                or any(q.lower() in note.lower() for note in r.contact_notes)]
-        show_records(hits)
-        return ""
 
-    # birthdays
-    if cmd == "add-birthday":
-        name, date = args
-        ab.find(name).add_birthday(date)
-        return ok("Birthday added.")
-    if cmd == "show-birthday":
-        key, = args
-        matches = [r for r in ab.data.values()
-                   if key.lower() in (r.name.value.lower(), r.surname.value.lower())]
-        if not matches:
-            raise KeyError("Contact not found.")
-        return "\n".join(f"{r.name.value} {r.surname.value}: "
-                         f"{r.birthday.value.strftime('%d.%m.%Y') if r.birthday else '—'}"
-                         for r in matches)
-    if cmd == "birthdays":
-        days, = args
-        if not days.isdigit():
-            raise ValueError("Enter a positive integer for the number of days")
-        matches = ab.upcoming(int(days))
-        show_birthdays(ab, matches)
-        return ""
+def _add_contact_note(args, ab: AddressBook):
+    name, *note = args
+    ab.find(name).add_contact_note(" ".join(note))
+    return ok("Note added.")
+
+
+def _back(args, ctx):
+    return "BACK"
 
-    # misc
-    if cmd == "add-contact-note":
-        name, *note = args
-        ab.find(name).add_contact_note(" ".join(note))
-        return ok("Note added.")
 
-    if cmd in ("back", "exit", "close"):
-        return "BACK"
-    return "Unknown contact command."
+CONTACT_HANDLERS = {
+    "hello": _contact_help, "help": _contact_help,
+    "add": _add, "change": _change,
+    "remove-phone": _remove_phone, "phone": _phone, "delete": _delete,
+    "all": _all, "search": _search,
+    "add-birthday": _add_birthday, "show-birthday": _show_birthday, "birthdays": _birthdays,
+    "add-contact-note": _add_contact_note,
+    "back": _back, "exit": _back, "close": _back,
+}
 
 
 @input_error
-def handle_notes(parts, nb: GeneralNoteBook):
-    cmd, *args = parts
-    if cmd in ("hello", "help"):
-        return help_msg("notes")
-    if cmd == "group-notes":
-        tag_filter = args[0].lower() if args else None
+def handle_contact(cmd: str, args, ab: AddressBook):
+    handler = CONTACT_HANDLERS.get(cmd)
+    if handler is None:
+        return "Unknown contact command."
+    return handler(args, ab)
+
+
+# ────────────────────────────────────────────────────────────────────────────
+# notes
+def _notes_help(args, nb: GeneralNoteBook):
+    return help_msg("notes")
+
+
+def _group_notes(args, nb: GeneralNoteBook):
+    tag_filter = args[0].lower() if args else None
 
-        groups = group_notes_by_tag(nb.notes)
-        if tag_filter:
-            groups = {tag_filter: groups.get(tag_filter, [])}
+    groups = nb.groups()
+    if tag_filter:
+        groups = {tag_filter: groups.get(tag_filter, [])}
 
-        if not groups or all(not lst for lst in groups.values()):
-            return f"[dim italic]No notes with tag '{tag_filter}'.[/]" if tag_filter else "[dim italic]No notes.[/]\n"
+    if not groups or all(not lst for lst in groups.values()):
+        return f"[dim italic]No notes with tag '{tag_filter}'.[/]" if tag_filter else "[dim italic]No notes.[/]\n"
 
+    with console:  # one write for the whole listing
         for tag, lst in groups.items():
             console.print(f"\n[bold blue]🏷️  {tag.upper()}[/] ({len(lst)})")
             for i, n in enumerate(lst, 1):
                 console.print(f"  {i}. {n.text}  [dim italic]{n.created_at}[/]")
+    return ""
+
+
+def _add_note(args, nb: GeneralNoteBook):
+    text = " ".join(args) if args else console.input("Text: ")
+    if not text.strip():
+        raise ValueError("Empty note.")
+    nb.add_note(text, [])
+    if console.input("Add tags? (y/n): ").lower().startswith("y"):
+        tags = TAG_SPLIT_RE.split(console.input("Tags: "))
+        nb.add_tags(-1, [t for t in tags if t])
+    return ok("Note saved.")
+
+
+def _list_notes(args, nb: GeneralNoteBook):
+    notes = nb.list_notes()
+    if not notes:
+        console.print("[dim italic]No notes.[/]")
         return ""
-    if cmd == "add-note":
-        text = " ".join(args) if args else console.input("Text: ")
-        if not text.strip():
-            raise ValueError("Empty note.")
-        nb.add_note(text, [])
-        if console.input("Add tags? (y/n): ").lower().startswith("y"):
-            tags = re.split(r"[ ,]+", console.input("Tags: "))
-            nb.notes[-1].tags.extend([t for t in tags if t])
-        return ok("Note saved.")
-    if cmd == "list-notes":
-        notes = nb.list_notes()
-        if not notes:
-            console.print("[dim italic]No notes.[/]")
-            return ""
-
-        table = Table(show_header=True, header_style="bold blue",
-                      box=None, expand=True)
-        table.add_column("#", justify="right", style="bold cyan", no_wrap=True)
-        table.add_column("Date", style="bright_cyan", no_wrap=True)
-        table.add_column("Tags", style="green")
-        table.add_column("Text", style="white")
-
-        for i, n in enumerate(notes, 1):
-            tags = ", ".join(n.tags) if n.tags else "—"
-            table.add_row(str(i), n.created_at.isoformat(), tags, n.text)
-
-        console.print(table)
+
+    table = Table(show_header=True, header_style="bold blue",
+                  box=None, expand=True)
+    table.add_column("#", justify="right", style="bold cyan", no_wrap=True)
+    table.add_column("Date", style="bright_cyan", no_wrap=True)
+    table.add_column("Tags", style="green")
+    table.add_column("Text", style="white")
+
+    for i, n in enumerate(notes, 1):
+        tags = ", ".join(n.tags) if n.tags else "—"
+        table.add_row(str(i), n.created_at.isoformat(), tags, n.text)
+
+    console.print(table)
+    return ""
+
+
+def _add_tag(args, nb: GeneralNoteBook):
+    idx, *tags = args
+    nb.add_tags(int(idx) - 1, tags)
+    return ok("Tags added.")
+
+
+def _search_tag(args, nb: GeneralNoteBook):
+    tag = args[0] if args else console.input("Tag: ")
+    res = nb.search_by_tag(tag)
+    console.print("\n".join([str(n) for n in res]) or f"No notes with tag '{tag}'.")
+    return ""
+
+
+QUERY_VECTOR_CACHE_SIZE = 128
+# запрос → его embedding: повторный семантический поиск не ходит в API
+QUERY_VECTORS: "OrderedDict[str, array]" = OrderedDict()
+
+
+def _search_note(args, nb: GeneralNoteBook):
+    if not nb.notes:
+        return "[dim italic]No notes to search.[/]"
+    query = " ".join(args) if args else console.input("Query: ")
+
+    # ---------- 1) быстрый keyword‑фильтр ----------
+    hits = [i for i, n in enumerate(nb.notes)
+            if simple_match(query, n)]
+    if hits:
+        console.print("[green]Keyword match:[/]")
+        console.print("\n".join([f"{i + 1}. {nb.notes[i]}" for i in hits]))
         return ""
 
-    if cmd == "add-tag":
-        idx, *tags = args
-        nb.notes[int(idx) - 1].tags.extend(tags)
-        return ok("Tags added.")
-    if cmd == "search-tag":
-        tag = args[0] if args else console.input("Tag: ")
-        res = nb.search_by_tag(tag)
-        console.print("\n".join(str(n) for n in res) or f"No notes with tag '{tag}'.")
+    # ---------- 2) семантика через embeddings (если ключами не получилось) ----------
+    if _client is None:
+        return "[yellow]AI search disabled (no key.txt).[/]"
+
+    attach_embeddings(nb)
+    stale = [n for n in nb.notes if n.embedding is None]
+    key = " ".join(query.split())
+    query_vec = QUERY_VECTORS.get(key)
+    texts = [n.embedding_text() for n in stale]
+    if query_vec is None:
+        texts.append(query)
+    try:
+        vectors = embed(texts) if texts else []
+    except ai.APIError:
+        return "[yellow]AI search is unavailable right now, try again later.[/]"
+    for n, vec in zip(stale, vectors):
+        n.embedding = vec
+    if query_vec is None:
+        query_vec = QUERY_VECTORS[key] = vectors[-1]
+        if len(QUERY_VECTORS) > QUERY_VECTOR_CACHE_SIZE:
+            QUERY_VECTORS.popitem(last=False)
+    else:
+        QUERY_VECTORS.move_to_end(key)
+    idxs = nb.semantic_search(query_vec)
+    if not idxs:
+        console.print("[dim italic]No semantic matches.[/]")
         return ""
-    if cmd == "search-note":
-        if not nb.notes:
-            return "[dim italic]No notes to search.[/]"
-        query = " ".join(args) if args else console.input("Query: ")
-
-        # ---------- 1) быстрый keyword‑фильтр ----------
-        hits = [i for i, n in enumerate(nb.notes)
-                if simple_match(query, n)]
-        if hits:
-            console.print("[green]Keyword match:[/]")
-            console.print("\n".join(f"{i + 1}. {nb.notes[i]}" for i in hits))
-            return ""
-
-        # ---------- 2) GPT‑семантика (если ключами не получилось) ----------
-        if _client is None:
-            return "[yellow]AI search disabled (no key.txt).[/]"
-
-        catalog = "\n".join(
-            f"{idx + 1}: {n.text}  [tags: {', '.join(n.tags) or '—'}]"
-            for idx, n in enumerate(nb.notes)
-        )
-        sys_msg = SEM_PROMPT + "\n" + catalog
-        resp = _client.chat.completions.create(
-            model="gpt-4o-mini",
-            temperature=0.0,
-            top_p=0.1,
-            max_tokens=20,
-            messages=[
-                {"role": "system", "content": sys_msg},
-                {"role": "user", "content": query}
-            ]
-        )
-        idxs = [int(x) for x in re.findall(r"\d+", resp.choices[0].message.content)]
-        if not idxs:
-            console.print("[dim italic]No semantic matches.[/]")
-            return ""
-        console.print("[magenta]Semantic match:[/]")
-        console.print("\n".join(f"{i}. {nb.notes[i - 1]}" for i in idxs))
-        return ""
\ No newline at end of file
+    console.print("[magenta]Semantic match:[/]")
+    console.print("\n".join([f"{i + 1}. {nb.notes[i]}" for i in idxs]))
+    return ""
+
+
+NOTE_HANDLERS = {
+    "hello": _notes_help, "help": _notes_help,
+    "group-notes": _group_notes, "add-note": _add_note, "list-notes": _list_notes,
+    "add-tag": _add_tag, "search-tag": _search_tag, "search-note": _search_note,
+}
+
+
+@input_error
+def handle_notes(cmd: str, args, nb: GeneralNoteBook):
+    handler = NOTE_HANDLERS.get(cmd)
+    if handler is None:
+        return None
+    return handler(args, nb)
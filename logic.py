@@ -1,7 +1,11 @@
 # import datetime
+import difflib
+import json
 import re
-# from collections import UserDict
-from typing import Optional, List, Type #Tuple
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import islice
+from typing import Iterable, Optional, List, Type #Tuple
 try:
     from rich.columns import Columns
     from rich.console import Console
@@ -18,6 +22,12 @@ except ImportError:  # pragma: no cover - fallback for minimal envs
         def input(self, prompt: str = "") -> str:
             return input(prompt)
 
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            print(end="", flush=True)
+
     class Columns(list):
         pass
 
@@ -42,6 +52,7 @@ except ImportError:  # pragma: no cover - fallback for minimal envs
         def __str__(self):
             return "\n".join(self.rows)
 import getpass
+import ai
 from ai import client as _client
 from models import GeneralNote, Field, Record, AddressBook
 from storage import *
@@ -54,10 +65,10 @@ console = Console()
 # ────────────────────────────────────────────────────────────────────────────
 CONTACT_DESC = {
     "add": "add new contact",
-    "change": "change contact name or phone or email or notes",
+    "change": "change <name> <phone|email|address> <value>",
     "remove-phone": "remove contact`s phone",
     "delete": "delete <Name>",
-    "all": "show all contacts",
+    "all": "show all contacts (all <page>)",
     "search": "search contact by name or phone or email or notes",
     "add-birthday": "add birthday to contact",
     "show-birthday": "show contact`s birthday",
@@ -85,21 +96,101 @@ NOTE_DESC = {
 # ────────────────────────────────────────────────────────────────────────────
 # GPT‑autocorrect helper
 # ────────────────────────────────────────────────────────────────────────────
+# Кириллические варианты команд (UA/RU) — локально, без GPT
+COMMAND_ALIASES = {
+    "додати": "add", "добавить": "add",
+    "змінити": "change", "изменить": "change",
+    "видалити": "delete", "удалить": "delete",
+    "всі": "all", "все": "all",
+    "пошук": "search", "поиск": "search", "знайти": "search", "найти": "search",
+    "день-народження": "add-birthday", "день-рождения": "add-birthday",
+    "дні-народження": "birthdays", "дни-рождения": "birthdays",
+    "нотатка": "add-note", "заметка": "add-note",
+    "нотатки": "list-notes", "заметки": "list-notes",
+    "тег": "add-tag",
+    "групи": "group-notes", "группы": "group-notes",
+    "допомога": "help", "помощь": "help",
+    "назад": "back",
+}
+LOCAL_MATCH_CUTOFF = 0.7
+
+CORRECTION_CACHE_SIZE = 512
+# (нормализованный ввод, команды режима) -> ответ GPT; сохраняется между сессиями
+CORRECTION_CACHE: "OrderedDict[tuple, Optional[tuple[str, tuple]]]" = OrderedDict()
+
+
 def suggest_correction(user_input: str,
-                       desc_map: dict[str, str]) -> Optional[str]:
+                       desc_map: dict[str, str]) -> Optional[tuple[str, tuple]]:
     """
-    Просим GPT‑4o‑mini угадать опечатанную команду.
-    Возвращает canonical‑имя команды или None.
+    Просим GPT‑4o‑mini угадать опечатанную команду и сразу извлечь её аргументы.
+    Возвращает (canonical‑имя команды, (аргументы)) или None.
     """
+    local = _local_correction(user_input, desc_map)
+    if local is not None:
+        return local
     if _client is None:
         return None
-    sys_prompt = (
+    key = (" ".join(user_input.split()), tuple(desc_map))
+    if key in CORRECTION_CACHE:
+        CORRECTION_CACHE.move_to_end(key)
+        return CORRECTION_CACHE[key]
+    try:
+        result = _ask_correction(user_input, desc_map)
+    except (ai.APIError, ValueError):
+        return None  # offline, timed out or a garbled reply: no guess, and nothing cached
+    CORRECTION_CACHE[key] = result
+    if len(CORRECTION_CACHE) > CORRECTION_CACHE_SIZE:
+        CORRECTION_CACHE.popitem(last=False)
+    return result
+
+
+def _local_correction(user_input: str,
+                      desc_map: dict[str, str]) -> Optional[tuple[str, tuple]]:
+    """Ближайшая команда по первому слову ввода; остальные слова — аргументы."""
+    word, *args = user_input.split() or [""]
+    word = word.lower()
+    aliases = {a: c for a, c in COMMAND_ALIASES.items() if c in desc_map}
+    candidates = [c for c in desc_map if " " not in c] + list(aliases)
+    hit = _prefix_match(word, candidates) or difflib.get_close_matches(
+        word, candidates, n=1, cutoff=LOCAL_MATCH_CUTOFF)
+    if not hit:
+        return None
+    return aliases.get(hit[0], hit[0]), tuple(args)
+
+
+def _prefix_match(word: str, candidates: List[str]) -> List[str]:
+    """Однозначный префикс команды или самая длинная команда, с которой начинается ввод."""
+    if not word:
+        return []
+    starts = [c for c in candidates if c.startswith(word)]
+    if len(starts) == 1:
+        return starts
+    heads = [c for c in candidates if word.startswith(c)]
+    return [max(heads, key=len)] if heads else []
+
+
+def _slot_names(cmd: str) -> List[str]:
+    return ARG_SLOTS.get(cmd, [])
+
+
+@lru_cache(maxsize=None)
+def _correction_prompt(cmds: tuple[str, ...]) -> str:
+    """Системный промпт для _ask_correction, один на режим."""
+    slots = "\n".join([f"{cmd}: {' / '.join(_slot_names(cmd)) or '—'}" for cmd in cmds])
+    return (
             "You are a CLI assistant that fixes mistyped commands. "
             "User may write RU/UA/EN with typos.\n\n"
-            "Supported commands:\n" +
-            "\n".join(desc_map.keys()) +
-            "\n\nReturn ONLY the canonical command name or empty string."
+            "Supported commands and their argument slots:\n" + slots +
+            "\n\nReturn ONLY JSON: {\"command\": \"<canonical name or empty>\", "
+            "\"args\": {\"<slot>\": \"<value found in the input>\"}, "
+            "\"missing\": [\"<slot not present in the input>\"]}"
     )
+
+
+def _ask_correction(user_input: str,
+                    desc_map: dict[str, str]) -> Optional[tuple[str, tuple]]:
+    """Команда и аргументы по слотам; ответ не в виде JSON‑объекта — ValueError."""
+    sys_prompt = _correction_prompt(tuple(desc_map))
     resp = _client.chat.completions.create(
         model="gpt-4o-mini",
         messages=[
@@ -107,19 +198,38 @@ def suggest_correction(user_input: str,
             {"role": "user", "content": user_input}
         ],
         temperature=0.0,
-        max_tokens=6
+        max_tokens=80,
+        response_format={"type": "json_object"}
     )
-    guess = resp.choices[0].message.content.strip().strip("\"'")
-    return guess if guess in desc_map else None
+    try:
+        data = json.loads(resp.choices[0].message.content)
+    except TypeError:  # no content at all
+        raise ValueError("empty reply") from None
+    if not isinstance(data, dict):
+        raise ValueError("reply is not a JSON object")
+    guess = str(data.get("command", "")).strip().strip("\"'")
+    if guess not in desc_map:
+        return None
+    found = data.get("args") or {}
+    if not isinstance(found, dict):
+        return guess, ()
+    missing = data.get("missing")
+    missing = {m for m in missing if isinstance(m, str)} if isinstance(missing, list) else set()
+    args = [str(found.get(s) or "").strip() if s not in missing else "" for s in _slot_names(guess)]
+    while args and not args[-1]:
+        args.pop()
+    return guess, tuple(args)
 
 # ────────────────────────────────────────────────────────────────────────────
 # simple keyword match
 # ────────────────────────────────────────────────────────────────────────────
+# tag lists are typed "a, b c"; note search matches whole words of the query
+TAG_SPLIT_RE = re.compile(r"[ ,]+")
+WORD_RE = re.compile(r"\w+")
+
 def simple_match(query: str, note: "GeneralNote") -> bool:
-    q_words = {w.lower() for w in re.findall(r"\w+", query)}
-    text    = note.text.lower()
-    tags    = " ".join(note.tags).lower()
-    return all(any(word in field for field in (text, tags)) for word in q_words)
+    hay = note.search_text()
+    return all(word in hay for word in set(WORD_RE.findall(query.lower())))
 
 # ────────────────────────────────────────────────────────────────────────────
 # Utility helpers
@@ -142,29 +252,44 @@ def prompt_validated(prompt: str, factory: Optional[Type[Field]] = None,
 
 
 def _panel_body(rec: Record, extra=""):
-    phones = ", ".join(p.value for p in rec.phones) or "—"
-    bday = rec.birthday.value.strftime("%d.%m.%Y") if rec.birthday else "—"
-    notes_list = getattr(rec, "contact_notes", [])
-    notes = " | ".join(notes_list) if notes_list else "—"
-    body = (
-        f"[b]📞[/b] {phones}\n"
-        f"[b]📧[/b] {rec.email.value or '—'}\n"
-        f"[b]📍[/b] {rec.address.value or '—'}\n"
-        f"[b]🎂[/b] {bday}\n"
-        f"[b]📝[/b] {notes}"
-    )
+    # один f-string на карточку; готовый текст живёт в rec.render_cache до изменения записи
+    body = rec.render_cache
+    if body is None:
+        body = rec.render_cache = (
+            f"[b]📞[/b] {', '.join(rec.phones) or '—'}\n"
+            f"[b]📧[/b] {rec.email or '—'}\n"
+            f"[b]📍[/b] {rec.address or '—'}\n"
+            f"[b]🎂[/b] {rec.birthday.formatted if rec.birthday else '—'}\n"
+            f"[b]📝[/b] {' | '.join(rec.contact_notes) or '—'}"
+        )
     return body + (f"\n{extra}" if extra else "")
 
 
-def show_records(recs: List[Record]):
-    if not recs:
+def _card(rec: Record):
+    """Panel карточки, закэшированная в записи до её изменения."""
+    panel = rec.panel_cache
+    if panel is None:
+        panel = rec.panel_cache = Panel(_panel_body(rec),
+                                        title=f"{rec.name.upper()} {rec.surname.upper()}".strip(),
+                                        border_style="cyan")
+    return panel
+
+
+RENDER_BATCH = 30
+PAGE_SIZE = 50      # карточек на одну страницу `all`
+
+
+def show_records(recs: Iterable[Record]):
+    """Рисуем карточки порциями по RENDER_BATCH."""
+    recs = iter(recs)
+    batch = list(islice(recs, RENDER_BATCH))
+    if not batch:
         console.print("[dim italic]No contacts.[/]")
         return
-    console.print(Columns(
-        [Panel(_panel_body(r),
-               title=f"{r.name.value.upper()} {r.surname.value.upper()}".strip(), border_style="cyan")
-         for r in recs],
-        equal=True, expand=True))
+    with console:  # rich копит вывод в буфере и пишет его одним write() в конце
+        while batch:
+            console.print(Columns([_card(r) for r in batch], equal=True, expand=True))
+            batch = list(islice(recs, RENDER_BATCH))
 
 
 def show_birthdays(book: AddressBook, matches):
@@ -172,22 +297,23 @@ def show_birthdays(book: AddressBook, matches):
         console.print("[dim italic]No birthdays in this period.[/]\n")
         return
 
-    ordered = sorted(matches.items(), key=lambda x: x[1][0])
-    panels = []
-
-    for key, (dt, age) in ordered:
-        rec = book.data[key]
-        full_name = f"{rec.name.value.title()} {rec.surname.value.title()}".strip()
-        panels.append(
-            Panel(
-                _panel_body(rec,
-                            extra=f"🎉 {dt.strftime('%d.%m.%Y')} / {age} years"),
-                title=full_name,
-                border_style="magenta"
-            )
+    def panel(key, dt, age):
+        rec = book[key]
+        full_name = f"{rec.name.title()} {rec.surname.title()}".strip()
+        return Panel(
+            _panel_body(rec,
+                        extra=f"🎉 {dt.day:02}.{dt.month:02}.{dt.year} / {age} years"),
+            title=full_name,
+            border_style="magenta"
         )
 
-    console.print(Columns(panels, equal=True, expand=True))
+    items = iter(matches.items())  # upcoming() returns them soonest first
+    batch = list(islice(items, RENDER_BATCH))
+    with console:  # as in show_records: one write() at the end
+        while batch:
+            console.print(Columns([panel(key, dt, age) for key, (dt, age) in batch],
+                                  equal=True, expand=True))
+            batch = list(islice(items, RENDER_BATCH))
 
 
 
@@ -205,9 +331,9 @@ def help_msg(section="contacts"):
 
 
 def input_error(fn):
-    def wrap(parts, *ctx):
+    def wrap(*args):
         try:
-            return fn(parts, *ctx)
+            return fn(*args)
         except (KeyError, IndexError):
             return "[red]Invalid command or args.[/]"
         except ValueError as e:
@@ -241,33 +367,74 @@ def login(users):
 # Argument spec
 # ────────────────────────────────────────────────────────────────────────────
 ARG_SPEC = {
-    "change_": 1, "remove-phone": 2, "phone": 1, "delete": 1,
+    "remove-phone": 2, "phone": 1, "delete": 1,
     "add-birthday": 2, "show-birthday": 1, "add-contact-note": 2,
     "change-address": 2, "change-email": 2, "search": 1, "birthdays": 1,
     # notes
     "add-tag": 2, "search-tag": 1, "search-note": 1, "group-notes": 0
 }
-CONTACT_CMDS = list(CONTACT_DESC.keys())
-NOTE_CMDS = list(NOTE_DESC.keys())
-
-
-def collect_args(cmd):
-    prompts = {
-        "remove-phone": ["Contact name: ", "Phone: "],
-        "phone": ["Contact name: "],
-        "delete": ["Contact name: "],
-        "add-birthday": ["Contact name: ", "Birthday DD.MM.YYYY: "],
-        "show-birthday": ["Name or surname: "],
-        "add-contact-note": ["Contact name: ", "Note: "],
-        "search": ["Enter name | surname | phone | notes: "],
-        "birthdays": ["Days from today (N): "],
-        # notes
-        "add-tag": ["Note index: ", "Tags (comma): "],
-        "search-tag": ["Tag: "],
-        "search-note": ["Phrase: "],
-    }
-    answers = [console.input(p).strip() for p in prompts.get(cmd, [])]
-    if cmd == "add-tag" and len(answers) == 2:
-        idx, tags = answers
-        return [idx] + [t for t in re.split(r"[ ,]+", tags) if t]
-    return answers
+CONTACT_CMDS = frozenset(CONTACT_DESC)
+NOTE_CMDS = frozenset(NOTE_DESC)
+EXIT_CMDS = frozenset(("exit", "close"))
+# commands that change a book — followed by a background autosave
+CONTACT_WRITES = frozenset(("add", "change", "remove-phone", "delete", "add-birthday", "add-contact-note"))
+NOTE_WRITES = frozenset(("add-note", "add-tag"))
+MODES = frozenset(("contacts", "notes"))
+
+
+ARG_PROMPTS = {
+    "change": ["Which contact do you want to change? >>> ",
+               "What do you want to change in this contact? (phone / email / address) >>> ",
+               "Enter new value >>> "],
+    "remove-phone": ["Contact name: ", "Phone: "],
+    "phone": ["Contact name: "],
+    "delete": ["Contact name: "],
+    "add-birthday": ["Contact name: ", "Birthday DD.MM.YYYY: "],
+    "show-birthday": ["Name or surname: "],
+    "add-contact-note": ["Contact name: ", "Note: "],
+    "search": ["Enter name | surname | phone | notes: "],
+    "birthdays": ["Days from today (N): "],
+    # notes
+    "add-tag": ["Note index: ", "Tags (comma): "],
+    "search-tag": ["Tag: "],
+    "search-note": ["Phrase: "],
+}
+# short names of the same slots, as GPT sees them in _correction_prompt
+ARG_SLOTS = {
+    "change": ["name", "field", "value"],
+    "remove-phone": ["name", "phone"],
+    "phone": ["name"],
+    "delete": ["name"],
+    "add-birthday": ["name", "birthday"],
+    "show-birthday": ["name"],
+    "add-contact-note": ["name", "note"],
+    "search": ["query"],
+    "birthdays": ["days"],
+    # notes
+    "add-tag": ["index", "tags"],
+    "search-tag": ["tag"],
+    "search-note": ["phrase"],
+}
+
+
+def parse_input(raw: str) -> tuple[str, tuple]:
+    """'cmd a b' → ('cmd', ('a', 'b'))."""
+    head = raw.split(None, 1)
+    if not head:
+        return "", ()
+    return head[0], tuple(head[1].split()) if len(head) > 1 else ()
+
+
+def collect_args(cmd, given=()):
+    """Спрашиваем только пустые и недостающие аргументы."""
+    if cmd == "change":
+        return list(given)  # _change asks for what is missing once it has found the field keyword
+    prompts = ARG_PROMPTS.get(cmd, [])
+    args = list(given) + [""] * (len(prompts) - len(given))
+    for i, prompt in enumerate(prompts):
+        if not args[i]:
+            args[i] = console.input(prompt).strip()
+    if cmd == "add-tag" and len(args) == 2:
+        idx, tags = args
+        return [idx] + [t for t in TAG_SPLIT_RE.split(tags) if t]
+    return args
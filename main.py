@@ -1,20 +1,15 @@
-# Rich is optional. Provide a very small fallback console
-try:
-    from rich.console import Console
-except ImportError:  # pragma: no cover - fallback for minimal envs
-    class Console:
-        def print(self, *args, **kwargs):
-            print(*args)
-
-        def input(self, prompt: str = "") -> str:
-            return input(prompt)
-
 from logic import *
 from handlers import *
 from storage import *
 from ai import client as _client
 
-console = Console()
+# mode → (prompt, commands, descriptions for autocorrect, handler, write commands, autosave)
+MODE_CONF = {
+    "contacts": ("\n[bold italic][orchid]Contacts[/]>>> Command: [/]",
+                 CONTACT_CMDS, CONTACT_DESC, handle_contact, CONTACT_WRITES, autosave_data),
+    "notes": ("\n[italic][navajo_white1]Notes[/]>>> Command: [/]",
+              NOTE_CMDS, NOTE_DESC, handle_notes, NOTE_WRITES, autosave_notes),
+}
 
 def main():
     users = load_users()
@@ -36,8 +31,8 @@ def main():
             console.print("[dim italic]Incalid input. Please enter 'l' for login or 'r' for register.[/]\n" )
 
     console.print(f"\n[bold]Hello, [blue]{username.capitalize()}[/], glad to see you![/]")
-    ab = load_data(username)
-    nb = load_notes(username)
+    ab = nb = None  # books are read on first entry into their mode
+    CORRECTION_CACHE.update(load_corrections(username))
     mode = "main"
 
     if _client is None:
@@ -49,76 +44,51 @@ def main():
             if mode == "main":
                 choice = console.input(
                     "\n[bold]Choose a mode > [orchid]contacts[/] | [navajo_white1]notes[/] or exit:[/] ").strip().lower()
-                if choice in ("exit", "close"):
-                    save_data(username, ab)
-                    save_notes(username, nb)
+                if choice in EXIT_CMDS:
+                    save_session(username, ab, nb, CORRECTION_CACHE)
                     console.print(ok("Data saved. Bye!"))
                     break
-                if choice in ("contacts", "notes"):
+                if choice in MODES:
                     mode = choice
+                    if mode == "contacts" and ab is None:
+                        ab = load_data(username)
+                    if mode == "notes" and nb is None:
+                        nb = load_notes(username)
                     help_msg(mode)
                     continue
                 console.print("Unknown mode.")
                 continue
 
-            # contacts
-            if mode == "contacts":
-                raw = console.input("\n[bold italic][orchid]Contacts[/]>>> Command: [/]").strip()
-                if raw in ("exit", "close"):
-                    save_data(username, ab)
-                    save_notes(username, nb)
-                    console.print(ok("Data saved. Bye!"));
-                    break
-                if raw == "back": mode = "main"; continue
-                parts = raw.split()
-                if not parts: continue
-                cmd = parts[0]
-                if cmd not in CONTACT_CMDS:
-                    sug = suggest_correction(raw, CONTACT_DESC)
-                    if sug and console.input(f"Did you mean '{sug}'? (y/n): ").lower().startswith("y"):
-                        parts = [sug] + collect_args(sug)
-                    else:
-                        console.print("[dim italic]Unknown command.[/]\n");
-                        continue
-                need = ARG_SPEC.get(parts[0], 0)
-                if len(parts) - 1 < need: parts += collect_args(parts[0])
-                res = handle_contact(parts, ab)
-                if res == "BACK":
-                    mode = "main"
-                elif res:
-                    console.print(res)
-
-            # notes
-            if mode == "notes":
-                raw = console.input("\n[italic][navajo_white1]Notes[/]>>> Command: [/]").strip()
-                if raw in ("exit", "close"):
-                    save_data(username, ab)
-                    save_notes(username, nb)
-                    console.print(ok("Data saved. Bye!"));
-                    break
-                if raw == "back": mode = "main"; continue
-                parts = raw.split()
-                if not parts: continue
-                cmd = parts[0]
-                if cmd not in NOTE_CMDS:
-                    sug = suggest_correction(raw, NOTE_DESC)
-                    if sug and console.input(f"Did you mean '{sug}'? (y/n): ").lower().startswith("y"):
-                        parts = [sug] + collect_args(sug)
-                    else:
-                        console.print("[dim italic]Unknown command.[/]\n");
-                        continue
-                need = ARG_SPEC.get(parts[0], 0)
-                if len(parts) - 1 < need: parts += collect_args(parts[0])
-                res = handle_notes(parts, nb)
-                if res == "BACK":
-                    mode = "main"
-                elif res:
-                    console.print(res)
+            # contacts / notes
+            prompt, cmds, desc, handler, writes, autosave = MODE_CONF[mode]
+            book = ab if mode == "contacts" else nb
+            raw = console.input(prompt).strip()
+            if raw in EXIT_CMDS:
+                save_session(username, ab, nb, CORRECTION_CACHE)
+                console.print(ok("Data saved. Bye!"));
+                break
+            if raw == "back": mode = "main"; continue
+            cmd, args = parse_input(raw)
+            if not cmd: continue
+            if cmd not in cmds:
+                sug = suggest_correction(raw, desc)
+                if sug and console.input(f"Did you mean '{sug[0]}'? (y/n): ").lower().startswith("y"):
+                    cmd, args = sug[0], collect_args(*sug)
+                else:
+                    console.print("[dim italic]Unknown command.[/]\n");
+                    continue
+            if len(args) < ARG_SPEC.get(cmd, 0): args = collect_args(cmd, args)
+            res = handler(cmd, args, book)
+            if cmd in writes:
+                autosave(username, book)
+            if res == "BACK":
+                mode = "main"
+            elif res:
+                console.print(res)
 
         except KeyboardInterrupt:
             console.print("\nInterrupted. Saving …")
-            save_data(username, ab)
-            save_notes(username, nb)
+            save_session(username, ab, nb, CORRECTION_CACHE)
             break
 
 
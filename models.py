@@ -1,8 +1,13 @@
+import calendar
 import datetime
-import datetime
+from bisect import bisect_left
+import difflib
+import heapq
 import re
-from typing import Optional, List, Tuple, Type
-from collections import UserDict
+from array import array
+from itertools import chain
+from operator import mul
+from typing import Optional, Iterable, List, Tuple, Type
 
 __all__ = [
     'Field', 'Name', 'Surname', 'Address', 'Email', 'Phone', 'Birthday',
@@ -23,8 +28,12 @@ def get_record_key(name: str, book: 'AddressBook') -> Optional[str]:
     name_parts = name.strip().split(maxsplit=1)
     if not name_parts:
         return None
+    key = make_key(*name_parts)
+    if key in book:  # ключи уже в нижнем регистре — точное совпадение без перебора
+        return key
 
-    matches = [k for k in book.data if all(part.lower() in k for part in name_parts)]
+    parts = [part.lower() for part in name_parts]
+    matches = [k for k in book if all(part in k for part in parts)]
     if len(matches) == 1:
         return matches[0]
     elif len(matches) > 1:
@@ -38,123 +47,382 @@ def get_record_key(name: str, book: 'AddressBook') -> Optional[str]:
 
 
 
+def _set_slots(obj, state):
+    """Pickle state: a plain dict (pre‑slots pickles) or a (dict, slots) pair."""
+    if isinstance(state, tuple):
+        state = {**(state[0] or {}), **state[1]}
+    for key, val in state.items():
+        setattr(obj, key, val)
+
+
 class Field:
+    __slots__ = ("value",)
+
     def __init__(self, value):  self.value = value
 
+    __setstate__ = _set_slots
+
     def __str__(self):          return str(self.value)
 
 
 class Name(Field):
+    __slots__ = ()
+
     def __init__(self, value: str):
         if not value.strip():
             raise ValueError("Name cannot be empty.")
         super().__init__(value.strip())
 
-class Surname(Field):  pass
+class Surname(Field):  __slots__ = ()
+
+class Address(Field):  __slots__ = ()
 
-class Address(Field):  pass
+_EMAIL_RE = re.compile(r"\A[^@\s]+@[^@\s]+\.[^@\s]+\Z")  # no whitespace inside ⇒ no backtracking over it
+
+def _validate_email(value: str) -> str:
+    v = value.strip()
+    if v and _EMAIL_RE.match(v) is None:
+        raise ValueError("Invalid e‑mail format.")
+    return v
 
 class Email(Field):
-    EMAIL_RE = re.compile(r"[^@]+@[^@]+\.[^@]+")
+    __slots__ = ()
+    EMAIL_RE = _EMAIL_RE
 
     def __init__(self, value: str):
-        v = value.strip()
-        if v and not Email.EMAIL_RE.fullmatch(v):
-            raise ValueError("Invalid e‑mail format.")
-        super().__init__(v)
+        super().__init__(_validate_email(value))
+
+_PHONE_RE = re.compile(r"\A[0-9]{10}\Z")  # ASCII only: \d would let "٠١٢…" through
+
+def _validate_phone(value: str) -> str:
+    if _PHONE_RE.match(value) is None:
+        raise ValueError("Phone must contain exactly 10 digits.")
+    return value
 
 class Phone(Field):
+    """Validator for prompts; a Record keeps its numbers as plain strings."""
+    __slots__ = ()
+
     def __init__(self, value: str):
-        if not value.isdigit() or len(value) != 10:
-            raise ValueError("Phone must contain exactly 10 digits.")
-        super().__init__(value)
+        super().__init__(_validate_phone(value))
+
+def _fmt_date(d: datetime.date) -> str:
+    """DD.MM.YYYY без strftime."""
+    return f"{d.day:02}.{d.month:02}.{d.year:04}"
 
 class Birthday(Field):
+    __slots__ = ("md", "formatted")
+
     def __init__(self, value: str):
         try:
-            dt = datetime.datetime.strptime(value, "%d.%m.%Y").date()
+            if (len(value) == 10 and value[2] == value[5] == "."  # обычный DD.MM.YYYY — без strptime
+                    and value[:2].isdigit() and value[3:5].isdigit() and value[6:].isdigit()):
+                dt = datetime.date(int(value[6:]), int(value[3:5]), int(value[:2]))
+            else:  # 1.2.1990 и подобное
+                dt = datetime.datetime.strptime(value, "%d.%m.%Y").date()
         except ValueError:
             raise ValueError("Date must be DD.MM.YYYY")
         if dt > datetime.date.today():
             raise ValueError("Birthday cannot be in the future.")
         super().__init__(dt)
+        self.md = (dt.month, dt.day)
+        self.formatted = _fmt_date(dt)
+
+    def __setstate__(self, state):
+        # older pickles carry only `value`
+        _set_slots(self, state)
+        self.md = (self.value.month, self.value.day)
+        self.formatted = _fmt_date(self.value)
+
+_CUM_DAYS = (0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334)
+_today, _fromordinal = datetime.date.today, datetime.date.fromordinal  # pre‑bound for the birthday paths
+
+
+def _day_of_year(month: int, day: int, leap: bool) -> int:
+    if month == 2 and day == 29 and not leap:
+        day = 28
+    return _CUM_DAYS[month - 1] + day + (leap and month > 2)
+
+
+def _scan_upcoming(months, days, today: datetime.date, days_ahead: int) -> list[tuple[int, int]]:
+    """(index, days until) for birthdays within `days_ahead`, soonest first; 29.02 → 28.02."""
+    leap, next_leap = calendar.isleap(today.year), calendar.isleap(today.year + 1)
+    today_doy = _day_of_year(today.month, today.day, leap)
+    to_new_year = 365 + leap - today_doy
+    hits, doy, n = [], _day_of_year, len(months)
+    start = bisect_left(range(n), today_doy, key=lambda i: doy(months[i], days[i], leap))
+    for i in chain(range(start, n), range(start)):
+        delta = doy(months[i], days[i], leap) - today_doy
+        if delta < 0:
+            delta = to_new_year + doy(months[i], days[i], next_leap)
+        if delta > days_ahead:
+            break
+        hits.append((i, delta))
+    return hits
+
 
 class Record:
+    __slots__ = ("name", "surname", "address", "email", "_phones",
+                 "birthday", "contact_notes", "_book", "name_lower", "surname_lower",
+                 "render_cache", "panel_cache", "haystack")
+
+    # name/surname/address/email are plain str — Name, Email… only validate prompts
     def __init__(self, name: str, surname: str = "", address: str = "", email: str = ""):
-        self.name = Name(name)
-        self.surname = Surname(surname)
-        self.address = address if isinstance(address, Address) else Address(address)
-        self.email = email if isinstance(email, Email) else Email(email)
-        self.phones: List[Phone] = []
+        name = name.strip()
+        if not name:
+            raise ValueError("Name cannot be empty.")
+        self.name = name
+        self.surname = surname
+        self.name_lower, self.surname_lower = name.lower(), surname.lower()  # for search
+        self.address = address
+        self.email = _validate_email(email)
+        self._phones: dict[str, None] = {}  # ordered set of numbers
         self.birthday: Optional[Birthday] = None
         self.contact_notes: List[str] = []
+        self.render_cache: Optional[str] = None  # card body, see logic._panel_body
+        self.panel_cache = None                  # the whole card renderable, see logic._card
+        self.haystack: Optional[str] = None      # search_text(), built on first search
+        self._book: Optional["AddressBook"] = None  # set by AddressBook.__setitem__
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+        # pre‑dict pickles keep a `phones` list (and maybe a `_phone_index`)
+        phones = state.pop("phones", None)
+        state.pop("_phone_index", None)
+        # …and wrap name/surname/address/email in Field objects
+        for key in ("name", "surname", "address", "email"):
+            if isinstance(state.get(key), Field):
+                state[key] = state[key].value
+        self._book = None  # older pickles never stored it
+        _set_slots(self, state)
+        if phones is not None:
+            self._phones = dict.fromkeys(p.value for p in phones)
+        self.name_lower, self.surname_lower = self.name.lower(), self.surname.lower()
+        self.render_cache = self.panel_cache = self.haystack = None
+
+    # phone ops — `_phones` keys are the numbers, insertion order = display order
+    @property
+    def phones(self) -> List[str]:
+        return list(self._phones)
 
-    # phone ops
     def add_phone(self, phone: str):
-        self.phones.append(Phone(phone))
+        self._phones.setdefault(_validate_phone(phone))
+        self._changed()
 
     def remove_phone(self, phone: str):
-        self.phones = [p for p in self.phones if p.value != phone]
-
-    def edit_phone(self, idx: int, new: str):
-        self.phones[idx] = Phone(new)
+        try:
+            del self._phones[phone]
+        except KeyError:
+            raise ValueError(f"Phone {phone} not found.") from None
+        self._changed()
+
+    def edit_phone(self, old: str, new: str):
+        if old not in self._phones:
+            raise ValueError(f"Phone {old} not found.")
+        new = _validate_phone(new)
+        if new != old and new in self._phones:
+            raise ValueError(f"Phone {new} already added.")
+        # rebuild to keep the edited number in its old position
+        self._phones = dict.fromkeys(new if k == old else k for k in self._phones)
+        self._changed()
+
+    def set_phone(self, phone: str):
+        """Replace all numbers with a single one."""
+        self._phones = {_validate_phone(phone): None}
+        self._changed()
 
     # misc
     def add_birthday(self, date_str: str):
         if self.birthday:
             raise ValueError("Birthday already set.")
         self.birthday = Birthday(date_str)
+        self._changed()
 
     def add_contact_note(self, note: str):
         if not note.strip():
             raise ValueError("Note cannot be empty.")
         self.contact_notes.append(note.strip())
+        self._changed()
+
+    def _changed(self):
+        self.render_cache = self.panel_cache = self.haystack = None
+        if self._book is not None:
+            self._book._invalidate()
+
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "surname": self.surname,
+            "address": self.address,
+            "email": self.email,
+            "phones": list(self._phones),
+            "birthday": self.birthday.formatted if self.birthday else None,
+            "notes": list(self.contact_notes),
+        }
+
+    @classmethod
+    def from_dict(cls, raw: dict) -> "Record":
+        rec = cls(raw["name"], raw["surname"], raw["address"])
+        rec.email = raw["email"]  # validated when it was entered — and older rules may differ
+        rec._phones = dict.fromkeys(raw["phones"])
+        if raw["birthday"]:
+            rec.birthday = Birthday(raw["birthday"])
+        rec.contact_notes = list(raw["notes"])
+        return rec
+
+    def update_surname(self, surname: str):
+        self.surname, self.surname_lower = surname, surname.lower()
+        self._changed()
+
+    def matches(self, ql: str) -> bool:
+        """Search predicate; `ql` is the lower‑cased query."""
+        return ql in self.search_text()
+
+    def search_text(self) -> str:
+        """Lower‑cased name, surname, phones and notes, \\x01‑separated; cached until a change."""
+        hay = self.haystack
+        if hay is None:
+            hay = self.haystack = "\x01".join([self.name_lower, self.surname_lower, *self._phones,
+                                                *(note.lower() for note in self.contact_notes)])
+        return hay
 
     def update_email(self, email: str):
-        self.email = Email(email)
+        self.email = _validate_email(email)
+        self._changed()
 
     def update_address(self, addr: str):
-        self.address = Address(addr)
-
+        self.address = addr
+        self._changed()
+
+
+def _trigrams(s: str) -> set[str]:
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+class AddressBook(dict):
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self._columns = None
+        self._trigrams = None
+        self._names = None
+        self._unsaved = False  # set by every change, cleared by storage once written
+        for key, rec in dict(*args, **kwargs).items():
+            self[key] = rec
+
+    def __setitem__(self, key: str, rec: Record):
+        rec._book = self
+        super().__setitem__(key, rec)
+        self._invalidate()
+
+    def __delitem__(self, key: str):
+        super().__delitem__(key)
+        self._invalidate()
+
+    def __reduce__(self):
+        return AddressBook.from_dict, (self.to_dict(),)
+
+    def __setstate__(self, state):
+        # pickles written before to_dict() are UserDict graphs: records under `data`
+        records = state.pop("data", {})
+        self.__dict__.update(state)
+        self._invalidate()
+        for key, rec in records.items():
+            self[key] = rec
+
+    def _invalidate(self):
+        self._columns = None
+        self._trigrams = None
+        self._names = None
+        self._unsaved = True
+
+    def _trigram_index(self) -> dict[str, set[str]]:
+        """trigram → keys of records whose search text contains it."""
+        if self._trigrams is None:
+            index: dict[str, set[str]] = {}
+            for key, rec in self.items():
+                for t in _trigrams(rec.search_text()):
+                    index.setdefault(t, set()).add(key)
+            self._trigrams = index
+        return self._trigrams
+
+    def _name_index(self) -> dict[str, list[Record]]:
+        """lower‑cased first name or surname → records, in book order."""
+        if self._names is None:
+            index: dict[str, list[Record]] = {}
+            for rec in self.values():
+                index.setdefault(rec.name_lower, []).append(rec)
+                if rec.surname_lower and rec.surname_lower != rec.name_lower:
+                    index.setdefault(rec.surname_lower, []).append(rec)
+            self._names = index
+        return self._names
+
+    def by_name(self, name: str) -> List[Record]:
+        """Records whose first name or surname is `name` (any case)."""
+        return self._name_index().get(name.lower(), [])
+
+    def closest_name(self, name: str, cutoff: float) -> Optional[str]:
+        """The first name or surname spelled most like `name`, or None."""
+        close = difflib.get_close_matches(name.lower(), self._name_index(), n=1, cutoff=cutoff)
+        return close[0] if close else None
+
+    def search(self, q: str) -> Iterable[Record]:
+        """Records matching `q` by name, surname, phone or note, in book order."""
+        ql = q.lower()
+        if len(ql) < 3:
+            return (r for r in self.values() if r.matches(ql))
+        index = self._trigram_index()
+        sets = sorted((index.get(t, set()) for t in _trigrams(ql)), key=len)
+        keys = sets[0].intersection(*sets[1:])
+        return (rec for key, rec in self.items() if key in keys and rec.matches(ql))
+
+    def to_dict(self) -> dict[str, dict]:
+        return {key: rec.to_dict() for key, rec in self.items()}
+
+    @classmethod
+    def from_dict(cls, raw: dict[str, dict]) -> "AddressBook":
+        book = cls()
+        for key, item in raw.items():
+            book[key] = Record.from_dict(item)
+        return book
 
-class AddressBook(UserDict):
     def add_record(self, rec: Record):
-        key = make_key(rec.name.value, rec.surname.value)
-        self.data[key] = rec
+        key = make_key(rec.name, rec.surname)
+        self[key] = rec
 
     def find(self, name: str) -> Record:
         key = get_record_key(name, self)
         if key is None:
             raise KeyError("Contact not found.")
-        return self.data[key]
+        return self[key]
 
     def delete(self, name: str):
-        del self.data[make_key_from_input(name)]
-
-    def upcoming(self, days_ahead: int) -> dict[str, tuple[datetime.date, int]]:
-
-        today = datetime.date.today()
-        result = {}
-
-        for key, rec in self.data.items():
-            if not rec.birthday:
-                continue
-
-            month, day = rec.birthday.value.month, rec.birthday.value.day
-            year = today.year
-            try:
-                next_bd = datetime.date(year, month, day)
-            except ValueError:
-                next_bd = datetime.date(year, 2, 28)
-            if next_bd < today:
-                try:
-                    next_bd = datetime.date(year + 1, month, day)
-                except ValueError:
-                    next_bd = datetime.date(year + 1, 2, 28)
-
-            delta = (next_bd - today).days
-            if 0 <= delta <= days_ahead:
-                result[key] = (next_bd, next_bd.year - rec.birthday.value.year)
+        del self[make_key_from_input(name)]
+
+    def _birthday_columns(self) -> tuple[list[str], array, array, array]:
+        """Key/month/day/year columns of records with a birthday, sorted by (month, day)."""
+        if self._columns is None:
+            keys, months, days, years = [], array("B"), array("B"), array("H")
+            dated = sorted(((key, rec.birthday) for key, rec in self.items() if rec.birthday),
+                           key=lambda kb: kb[1].md)
+            for key, bday in dated:
+                keys.append(key)
+                months.append(bday.md[0])
+                days.append(bday.md[1])
+                years.append(bday.value.year)
+            self._columns = (keys, months, days, years)
+        return self._columns
+
+    def upcoming(self, days_ahead: int,
+                 today: Optional[datetime.date] = None) -> dict[str, tuple[datetime.date, int]]:
+        today = today or _today()
+        keys, months, days, years = self._birthday_columns()
+        result, base = {}, today.toordinal()
+
+        for i, delta in _scan_upcoming(months, days, today, days_ahead):
+            next_bd = _fromordinal(base + delta)
+            result[keys[i]] = (next_bd, next_bd.year - years[i])
 
         return result
 
@@ -162,25 +430,118 @@ class AddressBook(UserDict):
 # ────────────────────────────────────────────────────────────────────────────
 # Notes
 # ────────────────────────────────────────────────────────────────────────────
+try:
+    from math import sumprod as _dot  # 3.12+: the whole dot product in one C loop
+except ImportError:
+    def _dot(a, b) -> float:
+        return sum(map(mul, a, b))
+
+
 class GeneralNote:
+    __slots__ = ("text", "tags", "created_at", "embedding", "haystack")
+
     def __init__(self, text: str, tags: List[str]):
         self.text = text.strip()
         self.tags = tags
         self.created_at = datetime.date.today()
+        self.embedding: Optional[array] = None
+        self.haystack: Optional[str] = None  # search_text(), built on first keyword search
+
+    def __setstate__(self, state):
+        self.embedding = self.haystack = None
+        _set_slots(self, state)
+
+    def add_tags(self, tags: List[str]):
+        self.tags.extend(tags)
+        self.embedding = self.haystack = None  # tags are part of the embedded and searched text
+
+    def search_text(self) -> str:
+        """Text and tags lower‑cased in one string, cached until the tags change."""
+        hay = self.haystack
+        if hay is None:
+            hay = self.haystack = "\x01".join([self.text, *self.tags]).lower()
+        return hay
+
+    def embedding_text(self) -> str:
+        return f"{self.text}  [tags: {', '.join(self.tags) or '—'}]"
 
     def __str__(self):
         tags = ", ".join(self.tags) if self.tags else "—"
         return f"{self.created_at.isoformat()}   [{tags}]   {self.text}"
 
+    def to_dict(self) -> dict:
+        # embeddings are stored separately (see storage.save_notes)
+        return {"text": self.text, "tags": list(self.tags), "created_at": self.created_at.isoformat()}
 
-class GeneralNoteBook:
-    def __init__(self): self.notes: List[GeneralNote] = []
+    @classmethod
+    def from_dict(cls, raw: dict) -> "GeneralNote":
+        note = cls(raw["text"], list(raw["tags"]))
+        note.created_at = datetime.date.fromisoformat(raw["created_at"])
+        return note
 
-    def add_note(self, text: str, tags: List[str]): self.notes.append(GeneralNote(text, tags))
+
+class GeneralNoteBook:
+    def __init__(self):
+        self.notes: List[GeneralNote] = []
+        self._emb_path: Optional[str] = None  # embeddings file not read yet
+        self._tags: Optional[dict[str, List[GeneralNote]]] = None    # see search_by_tag
+        self._groups: Optional[dict[str, List[GeneralNote]]] = None  # see groups
+        self._unsaved = False  # as in AddressBook
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault("_emb_path", None)
+        self._invalidate()
+
+    def __reduce__(self):
+        return GeneralNoteBook.from_dict, (self.to_dict(),)
+
+    def to_dict(self) -> dict:
+        return {"notes": [n.to_dict() for n in self.notes]}
+
+    @classmethod
+    def from_dict(cls, raw: dict) -> "GeneralNoteBook":
+        nb = cls()
+        nb.notes = [GeneralNote.from_dict(n) for n in raw["notes"]]
+        return nb
+
+    def add_note(self, text: str, tags: List[str]):
+        self.notes.append(GeneralNote(text, tags))
+        self._invalidate()
+
+    def add_tags(self, idx: int, tags: List[str]):
+        """Tag edits go through the book so the tag index can be dropped."""
+        self.notes[idx].add_tags(tags)
+        self._invalidate()
+
+    def _invalidate(self):
+        self._tags = None
+        self._groups = None
+        self._unsaved = True
 
     def list_notes(self): return self.notes
 
-    def search_by_tag(self, tag: str): return [n for n in self.notes if tag in n.tags]
+    def search_by_tag(self, tag: str) -> List[GeneralNote]:
+        """Notes carrying `tag`, in book order."""
+        if self._tags is None:
+            index: dict[str, List[GeneralNote]] = {}
+            for n in self.notes:
+                for t in dict.fromkeys(n.tags):
+                    index.setdefault(t, []).append(n)
+            self._tags = index
+        return list(self._tags.get(tag, ()))
+
+    def groups(self) -> dict[str, List[GeneralNote]]:
+        """group_notes_by_tag over the whole book, cached until the next change."""
+        if self._groups is None:
+            self._groups = group_notes_by_tag(self.notes)
+        return self._groups
+
+    def semantic_search(self, query_vec: array, k: int = 5, min_score: float = 0.3) -> List[int]:
+        """Indices of the `k` notes closest to `query_vec` (unit vectors, so a dot product)."""
+        scored = ((_dot(n.embedding, query_vec), i)
+                  for i, n in enumerate(self.notes) if n.embedding is not None)
+        return [i for score, i in heapq.nlargest(k, scored) if score >= min_score]
 
 def group_notes_by_tag(notes: list["GeneralNote"]) -> dict[str, list["GeneralNote"]]:
     from collections import defaultdict
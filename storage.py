@@ -1,5 +1,14 @@
+import gc
+import json
+import mmap
 import os
 import pickle
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional
 from logic import *
 from models import *
 
@@ -16,44 +25,258 @@ def user_path(username: str, base: str) -> str:
 # Persistence
 # ────────────────────────────────────────────────────────────────────────────
 
-DATA_FILE, NOTES_FILE = "addressbook.pkl", "notesbook.pkl"
+DATA_FILE, NOTES_FILE = "addressbook.json", "notesbook.json"
+LEGACY_DATA_FILE, LEGACY_NOTES_FILE = "addressbook.pkl", "notesbook.pkl"  # read once, then replaced
+CORRECTIONS_FILE = "corrections.pkl"
+EMBEDDINGS_FILE = "embeddings.pkl"
+_IO_BUFFER = 1 << 20  # one big buffer instead of many small read()/write() calls
+BACKUPS = 2           # addressbook.json.bak1 (as of the previous session), .bak2 (the one before)
+FSYNC_ON_EXIT = os.environ.get("ADDRESSBOOK_FSYNC") == "1"  # off unless ADDRESSBOOK_FSYNC=1
 
 
-def _save(obj, path):
-    with open(path, "wb") as f:
-        pickle.dump(obj, f)
+def _write_atomic(path, data: bytes, full_sync: bool = False):
+    """Write to a temp file and swap it in; fsync only when asked."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb", buffering=_IO_BUFFER) as f:
+        f.write(data)
+        if full_sync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def _save(obj, path, full_sync: bool = False):
+    _write_atomic(path, pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL), full_sync)
+
+def _rotate(path):
+    """path → .bak1 → .bak2 by renames only."""
+    if not os.path.exists(path):
+        return
+    for i in range(BACKUPS, 1, -1):
+        if os.path.exists(f"{path}.bak{i - 1}"):
+            os.replace(f"{path}.bak{i - 1}", f"{path}.bak{i}")
+    os.replace(path, f"{path}.bak1")
+
+# files already rotated this session: later writes overwrite in place, so .bak1 keeps
+# the state the session started from instead of a copy of the last autosave
+_rotated: set[str] = set()
+
+def _rotate_once(path):
+    if path not in _rotated:
+        _rotate(path)
+        _rotated.add(path)
+
+@contextmanager
+def _gc_paused():
+    """Cyclic GC off while a whole book is converted to or from dicts."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def _dump_json(obj) -> bytes:
+    with _gc_paused():
+        return json.dumps(obj.to_dict(), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _save_json(obj, path, full_sync: bool = False):
+    data = _dump_json(obj)
+    _rotate_once(path)
+    _write_atomic(path, data, full_sync)
+    obj._unsaved = False
+
+
+class _Autosaver:
+    """Background writer: takes ready bytes from the REPL; pending saves of one file collapse."""
+
+    def __init__(self):
+        self._pending: dict[str, bytes] = {}
+        self._cv = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self.failed: set[str] = set()  # files whose newest autosave did not land
+
+    def submit(self, path: str, data: bytes):
+        with self._cv:
+            self._pending[path] = data
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="autosave", daemon=True)
+                self._thread.start()
+            self._cv.notify()
+
+    def _run(self):
+        while True:
+            with self._cv:
+                while not self._pending and self._thread is not None:
+                    self._cv.wait()
+                if not self._pending:
+                    return
+                batch, self._pending = self._pending, {}
+            for path, data in batch.items():
+                try:
+                    _rotate_once(path)
+                    _write_atomic(path, data)
+                    self.failed.discard(path)
+                except OSError:
+                    self.failed.add(path)  # the save on exit writes the book again
+
+    def drain(self):
+        """Finish queued writes and stop the thread (before the final save on exit)."""
+        with self._cv:
+            thread, self._thread = self._thread, None
+            self._cv.notify()
+        if thread is not None:
+            thread.join()
+
+
+_autosaver = _Autosaver()
+# books changed this session; the rest are current on disk
+_dirty: set[str] = set()
+
+def _autosave(path: str, obj):
+    if not obj._unsaved:
+        return  # the command was rejected or changed nothing — nothing to dump
+    obj._unsaved = False
+    _dirty.add(path)
+    _autosaver.submit(path, _dump_json(obj))
+
+def autosave_data(username: str, ab):
+    _autosave(user_path(username, DATA_FILE), ab)
+
+def autosave_notes(username: str, nb):
+    _autosave(user_path(username, NOTES_FILE), nb)
+
+def _load_json(path, cls, legacy_path):
+    """JSON book; falls back to the legacy pickle, then to the newest readable backup."""
+    candidates = [p for p in [path] + [f"{path}.bak{i}" for i in range(1, BACKUPS + 1)]
+                  if os.path.exists(p)]
+    if not candidates:
+        return _load(legacy_path, cls)
+    for candidate in candidates:
+        try:
+            with open(candidate, "rb", buffering=_IO_BUFFER) as f, _gc_paused():
+                return cls.from_dict(json.load(f))
+        except (ValueError, KeyError):
+            pass
+    return cls()
 
 def _load(path, factory):
+    """Unpickle from a read‑only mmap."""
+    if not os.path.exists(path):  # first run: no file yet, skip the raise/catch
+        return factory()
     try:
-        with open(path, "rb") as f:
-            return pickle.load(f)
-    except (FileNotFoundError, pickle.PickleError):
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return pickle.loads(mm)
+    except (FileNotFoundError, pickle.PickleError, EOFError, ValueError):  # ValueError: empty file
         return factory()
 
 def load_data(username: str):
-    return _load(user_path(username, DATA_FILE), AddressBook)
+    ab = _load_json(user_path(username, DATA_FILE), AddressBook,
+                    user_path(username, LEGACY_DATA_FILE))
+    ab._unsaved = False  # filling the book on load is not a change
+    return ab
 
 def load_notes(username: str):
-    return _load(user_path(username, NOTES_FILE), GeneralNoteBook)
+    nb = _load_json(user_path(username, NOTES_FILE), GeneralNoteBook,
+                    user_path(username, LEGACY_NOTES_FILE))
+    nb._unsaved = False
+    nb._emb_path = user_path(username, EMBEDDINGS_FILE)  # read on first semantic search
+    return nb
+
+def save_data(username: str, ab, full_sync: bool = FSYNC_ON_EXIT):
+    path = user_path(username, DATA_FILE)
+    _save_json(ab, path, full_sync)
+    _dirty.discard(path)
+
+def save_notes(username: str, nb, full_sync: bool = FSYNC_ON_EXIT):
+    path = user_path(username, NOTES_FILE)
+    _save_json(nb, path, full_sync)
+    _dirty.discard(path)
+    _save_embeddings(username, nb, full_sync)
+
+def _save_embeddings(username: str, nb, full_sync: bool = False):
+    if nb._emb_path is None:  # vectors are in memory — otherwise the file on disk is still current
+        _save(_pack_embeddings(nb), user_path(username, EMBEDDINGS_FILE), full_sync)
+
+
+def _sync(path):
+    if FSYNC_ON_EXIT:
+        with open(path, "rb") as f:
+            os.fsync(f.fileno())
+
+def _autosaved(path, book) -> bool:
+    return not book._unsaved and path not in _autosaver.failed
+
+
+def save_session(username: str, ab, nb, cache):
+    """Writes only the books changed this session that the autosave has not written."""
+    _autosaver.drain()
+    data_path, notes_path = user_path(username, DATA_FILE), user_path(username, NOTES_FILE)
+    if ab is not None and data_path in _dirty:
+        if _autosaved(data_path, ab):
+            _sync(data_path)
+        else:
+            save_data(username, ab)
+    if nb is not None:
+        if notes_path in _dirty and not _autosaved(notes_path, nb):
+            save_notes(username, nb)
+        else:
+            if notes_path in _dirty:
+                _sync(notes_path)
+            _save_embeddings(username, nb, FSYNC_ON_EXIT)  # search-note may have added vectors
+    save_corrections(username, cache)
+
+
+def _note_crc(note) -> int:
+    return zlib.crc32(note.embedding_text().encode("utf-8"))
+
+
+def _pack_embeddings(nb) -> dict:
+    rows = [(i, _note_crc(n)) for i, n in enumerate(nb.notes) if n.embedding is not None]
+    data = b"".join([nb.notes[i].embedding.tobytes() for i, _ in rows])
+    return {"rows": rows, "data": data}
+
+
+def attach_embeddings(nb):
+    """Load stored note embeddings into `nb` once, dropping stale rows."""
+    if nb._emb_path is None:
+        return
+    packed = _load(nb._emb_path, dict)
+    nb._emb_path = None
+    rows = packed.get("rows", [])
+    if not rows:
+        return
+    flat = array("f")
+    flat.frombytes(packed["data"])
+    dim = len(flat) // len(rows)
+    for r, (i, crc) in enumerate(rows):
+        if i < len(nb.notes) and _note_crc(nb.notes[i]) == crc:
+            nb.notes[i].embedding = flat[r * dim:(r + 1) * dim]
 
-def save_data(username: str, ab):
-    _save(ab, user_path(username, DATA_FILE))
+def load_corrections(username: str):
+    return _load(user_path(username, CORRECTIONS_FILE), OrderedDict)
 
-def save_notes(username: str, nb):
-    _save(nb, user_path(username, NOTES_FILE))
+def save_corrections(username: str, cache):
+    _save(cache, user_path(username, CORRECTIONS_FILE))  # only a cache — no fsync
 
 
-USERS_FILE = "users.pkl"
+USERS_FILE, LEGACY_USERS_FILE = "users.json", "users.pkl"  # the pickle is read once, then replaced
 
 
 def load_users():
+    """login → password map from users.json."""
+    if not os.path.exists(USERS_FILE):
+        users = _load(LEGACY_USERS_FILE, dict)
+        if users:
+            save_users(users)  # migrate now, so the pickle is never read again
+        return users
     try:
         with open(USERS_FILE, "rb") as f:
-            return pickle.load(f)
-    except (FileNotFoundError, pickle.PickleError):
-        return {}
+            return json.load(f)
+    except ValueError:
+        return _load(LEGACY_USERS_FILE, dict)
 
 
 def save_users(users):
-    with open(USERS_FILE, "wb") as f:
-        pickle.dump(users, f)
\ No newline at end of file
+    data = json.dumps(users, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    _write_atomic(USERS_FILE, data, full_sync=True)
\ No newline at end of file